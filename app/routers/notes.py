@@ -2,7 +2,7 @@ import json
 import logging
 from typing import List
 
-from fastapi import APIRouter, Request
+from fastapi import APIRouter, Request, HTTPException
 from fastapi import Depends
 from sqlalchemy.orm import Session
 from starlette.background import BackgroundTasks
@@ -48,6 +48,9 @@ async def get_note_embedding(request: EmbeddingComputationRequest,
                              strategy: str = 'local',
                              db: Session = Depends(get_db),
                              notes_service: NotesService = Depends(get_notes_service)) -> EmbeddingComputationResponse:
+    if len(request.texts) > notes_service.embeddings_max_texts:
+        raise HTTPException(status_code=413,
+                            detail=f"At most {notes_service.embeddings_max_texts} texts can be sent at once")
     embeddings: List[TextWithEmbeddings] = []
     for text in request.texts:
         embedding = await notes_service.compute_embeddings(text.text)
@@ -3,7 +3,7 @@ import os
 import re
 import xml
 from threading import Lock
-from typing import List
+from typing import List, Tuple
 
 import aiohttp
 import faiss
@@ -20,7 +20,8 @@ from models.embeddings import EmbeddingComputationRequest, TextReference, Embedd
 from models.notes import Note as NoteModel, NoteReferential
 from services.singleton import Singleton
 from store.schema.noteentity import NoteEntity
-from utils.constants import REPLACEMENTS
+from utils.constants import REPLACEMENTS, MIN_SENTENCE_TOKENS, QUERY_MAX_SENTENCES, QUERY_MAX_TOKENS, \
+    INGESTION_MAX_SENTENCES, INGESTION_MAX_TOKENS, EMBEDDINGS_MAX_TEXTS
 
 logger = logging.getLogger(__name__)
 
@@ -36,10 +37,16 @@ class NotesService(metaclass=Singleton):
         self.model = SentenceTransformer('sentence-transformers/LaBSE', cache_folder=models_cache_dir)
         self.cache_loaded = False
         self.notes_reference_dao = notes_reference_dao
+        self.min_sentence_tokens = int(os.getenv('PYNOTES_MIN_SENTENCE_TOKENS', MIN_SENTENCE_TOKENS))
+        self.query_max_sentences = int(os.getenv('PYNOTES_QUERY_MAX_SENTENCES', QUERY_MAX_SENTENCES))
+        self.query_max_tokens = int(os.getenv('PYNOTES_QUERY_MAX_TOKENS', QUERY_MAX_TOKENS))
+        self.ingestion_max_sentences = int(os.getenv('PYNOTES_INGESTION_MAX_SENTENCES', INGESTION_MAX_SENTENCES))
+        self.ingestion_max_tokens = int(os.getenv('PYNOTES_INGESTION_MAX_TOKENS', INGESTION_MAX_TOKENS))
+        self.embeddings_max_texts = int(os.getenv('PYNOTES_EMBEDDINGS_MAX_TEXTS', EMBEDDINGS_MAX_TEXTS))
 
     async def search(self, db: Session, q: str = None, offset: int = 0, count: int = 20) -> List[NoteModel]:
         if q:
-            q_embeddings: np.ndarray = await self.compute_embeddings(q)
+            q_embeddings: np.ndarray = await self.compute_embeddings(q, is_query=True)
             await self.load_index(db=db, force_reload=False)
             similarities_asc, vectors_index = self.index.search(q_embeddings, k=offset + count)
             results_idxs: List[int] = vectors_index[offset:].tolist()[0]
@@ -56,12 +63,87 @@ class NotesService(metaclass=Singleton):
     def find_note_by_uri(self, note_uri: str, db: Session) -> NoteEntity:
         return get_note_by_uri(db, note_uri)
 
-    async def compute_embeddings(self, sentences: str) -> np.ndarray:
-        sentences: List[str] = self._split_sentences(sentences)
+    async def compute_embeddings(self, sentences: str, is_query: bool = False) -> np.ndarray:
+        lines: List[str] = self._split_sentences(sentences)
+        packed: List[Tuple[str, int]] = self._pack_sentences(lines)
+        if len(packed) < len(lines):
+            logger.debug("Packed %d lines into %d vectors (%d saved)", len(lines), len(packed),
+                         len(lines) - len(packed))
+        if is_query:
+            packed = self._apply_budget(packed, self.query_max_sentences, self.query_max_tokens)
+        else:
+            packed = self._apply_budget(packed, self.ingestion_max_sentences, self.ingestion_max_tokens)
+        sentences: List[str] = [sentence for sentence, _ in packed]
         logger.debug("Computing embeddings of %s", sentences)
+        # SentenceTransformer.encode already sorts its input by length before batching
         embeddings = self.model.encode(sentences).astype(np.float32)
         return embeddings
 
+    def _pack_sentences(self, lines: List[str]) -> List[Tuple[str, int]]:
+        """
+        Merges short lines with their neighbours and splits the ones that would be truncated by the model
+        :return: the packed sentences along with their length in tokens
+        """
+        if not lines:
+            return []
+        # Leave room for the [CLS] and [SEP] tokens added by the model
+        max_tokens = self.model.max_seq_length - 2
+        encoded = self.model.tokenizer(lines, add_special_tokens=False, return_offsets_mapping=True)
+        pieces: List[Tuple[str, int]] = []
+        for line, offsets in zip(lines, encoded['offset_mapping']):
+            if len(offsets) <= max_tokens:
+                pieces.append((line, len(offsets)))
+                continue
+            for start in range(0, len(offsets), max_tokens):
+                window = offsets[start:start + max_tokens]
+                piece = line[window[0][0]:window[-1][1]].strip()
+                if piece:
+                    pieces.append((piece, len(window)))
+        packed: List[Tuple[str, int]] = []
+        buffer: Tuple[str, int] = pieces[0]
+        for piece in pieces[1:]:
+            if buffer[1] < self.min_sentence_tokens and self._joined_length(buffer, piece) <= max_tokens:
+                buffer = self._join_sentences(buffer, piece)
+            else:
+                self._append_packed_sentence(packed, buffer, max_tokens)
+                buffer = piece
+        self._append_packed_sentence(packed, buffer, max_tokens)
+        return packed
+
+    def _append_packed_sentence(self, packed: List[Tuple[str, int]], sentence: Tuple[str, int], max_tokens: int):
+        """
+        Appends the sentence, merging it into the previous one when it is too short to stand alone
+        """
+        if sentence[1] < self.min_sentence_tokens and packed \
+                and self._joined_length(packed[-1], sentence) <= max_tokens:
+            packed[-1] = self._join_sentences(packed[-1], sentence)
+        else:
+            packed.append(sentence)
+
+    @staticmethod
+    def _joined_length(first: Tuple[str, int], second: Tuple[str, int]) -> int:
+        # The joining '.' costs one more token
+        return first[1] + second[1] + 1
+
+    @staticmethod
+    def _join_sentences(first: Tuple[str, int], second: Tuple[str, int]) -> Tuple[str, int]:
+        return f"{first[0]}. {second[0]}", NotesService._joined_length(first, second)
+
+    def _apply_budget(self, packed: List[Tuple[str, int]], max_sentences: int, max_tokens: int) -> List[Tuple[str, int]]:
+        """
+        Keeps the leading sentences fitting in the budget, the first one always being kept
+        """
+        kept: List[Tuple[str, int]] = []
+        total_tokens = 0
+        for sentence, nb_tokens in packed:
+            if kept and (len(kept) >= max_sentences or total_tokens + nb_tokens > max_tokens):
+                logger.warning("Encoding budget of %d sentences / %d tokens reached, dropping %d of %d sentences",
+                               max_sentences, max_tokens, len(packed) - len(kept), len(packed))
+                break
+            kept.append((sentence, nb_tokens))
+            total_tokens += nb_tokens
+        return kept
+
     def _sanitize_line(self, line: str) -> List[str]:
         for (replaced, replacement) in REPLACEMENTS:
             line = line.replace(replaced, replacement)
@@ -178,6 +260,7 @@ class NotesService(metaclass=Singleton):
     async def _populate_db_from_remote_service(self, db: Session):
         delete_all_notes(db)
         count, offset = 20, 0
+        nb_notes, nb_vectors = 0, 0
         while True:
             try:
                 notes = await self.notes_reference_dao.fetch_notes(count=count, offset=offset)
@@ -187,6 +270,8 @@ class NotesService(metaclass=Singleton):
                             embd = await self.compute_embeddings(note.valeur)
                             note_entity = NoteEntity(uri=note.uri, sentence_embeddings=embd)
                             db.add(note_entity)
+                            nb_notes += 1
+                            nb_vectors += embd.shape[0]
                         except BaseException as err:
                             logger.error(f"Error while computing embeddings of :\n"
                                          f"---\n"
@@ -200,3 +285,4 @@ class NotesService(metaclass=Singleton):
                 logger.error(f"Error while fetching notes at url offset {offset}\n{err=}")
                 break
         db.commit()
+        logger.info(f"Indexed {nb_notes} notes into {nb_vectors} vectors")
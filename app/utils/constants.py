@@ -1,4 +1,13 @@
 SENTENCE_EMBEDDING_DIMENSION = 768
+# Lines shorter than this (in tokens) are merged with their neighbours before encoding
+MIN_SENTENCE_TOKENS = 8
+# Per-request encoding budgets, overridable through environment variables
+QUERY_MAX_SENTENCES = 8
+QUERY_MAX_TOKENS = 512
+INGESTION_MAX_SENTENCES = 512
+INGESTION_MAX_TOKENS = 32768
+# Maximum number of texts accepted by a single embeddings computation request
+EMBEDDINGS_MAX_TEXTS = 20
 REPLACEMENTS = [
     ('&nbsp;', ' '),
     ('&xrarr;', ' implique '),
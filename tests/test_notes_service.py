@@ -0,0 +1,75 @@
+import re
+
+import pytest
+
+pytest.importorskip('faiss')
+pytest.importorskip('sentence_transformers')
+
+from services.notes import NotesService
+
+
+class WhitespaceTokenizer:
+    """Stub tokenizer producing one token per word"""
+
+    def __call__(self, lines, **kwargs):
+        return {'offset_mapping': [[match.span() for match in re.finditer(r'\S+', line)] for line in lines]}
+
+
+class StubModel:
+    def __init__(self, max_seq_length: int):
+        self.max_seq_length = max_seq_length
+        self.tokenizer = WhitespaceTokenizer()
+
+
+def build_service(max_seq_length: int, min_sentence_tokens: int) -> NotesService:
+    # Bypass the constructor so that no real model gets loaded
+    service = object.__new__(NotesService)
+    service.model = StubModel(max_seq_length)
+    service.min_sentence_tokens = min_sentence_tokens
+    return service
+
+
+def test_pack_sentences_merges_short_lines():
+    service = build_service(max_seq_length=12, min_sentence_tokens=4)
+    packed = service._pack_sentences(["a", "b c", "d e f g h", "i", "j k l m n"])
+    assert packed == [("a. b c", 4), ("d e f g h", 5), ("i. j k l m n", 7)]
+
+
+def test_pack_sentences_merges_short_line_into_previous_when_next_does_not_fit():
+    service = build_service(max_seq_length=9, min_sentence_tokens=4)
+    packed = service._pack_sentences(["d e f g h", "i", "j k l m n o p"])
+    assert packed == [("d e f g h. i", 7), ("j k l m n o p", 7)]
+
+
+def test_pack_sentences_splits_long_lines():
+    service = build_service(max_seq_length=5, min_sentence_tokens=1)
+    packed = service._pack_sentences(["a b c d e f g"])
+    assert packed == [("a b c", 3), ("d e f", 3), ("g", 1)]
+
+
+def test_pack_sentences_never_exceeds_max_tokens_when_min_is_above_it():
+    service = build_service(max_seq_length=5, min_sentence_tokens=10)
+    packed = service._pack_sentences(["a", "b", "c", "d"])
+    assert packed == [("a. b", 3), ("c. d", 3)]
+
+
+def test_pack_sentences_empty_input():
+    service = build_service(max_seq_length=12, min_sentence_tokens=4)
+    assert service._pack_sentences([]) == []
+
+
+def test_apply_budget_on_sentence_count():
+    service = build_service(max_seq_length=12, min_sentence_tokens=4)
+    packed = [("a", 1), ("b", 1), ("c", 1)]
+    assert service._apply_budget(packed, max_sentences=2, max_tokens=100) == [("a", 1), ("b", 1)]
+
+
+def test_apply_budget_on_token_count():
+    service = build_service(max_seq_length=12, min_sentence_tokens=4)
+    packed = [("a b", 2), ("c d", 2), ("e", 1)]
+    assert service._apply_budget(packed, max_sentences=10, max_tokens=3) == [("a b", 2)]
+
+
+def test_apply_budget_always_keeps_first_sentence():
+    service = build_service(max_seq_length=12, min_sentence_tokens=4)
+    assert service._apply_budget([("a b c", 3)], max_sentences=1, max_tokens=1) == [("a b c", 3)]